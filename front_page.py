@@ -17,21 +17,27 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import tkinter as tk
+import threading
 import customtkinter as ctk
-from main import main
+from main import main, has_credentials
 from gui import TransactionViewer
 from datetime import datetime
 from functions_gui import ensure_settings_file, load_settings, SETTINGS_PATH
+from imap_session import get_session, close_session, SECURITY_MODES
+from transaction_store import TransactionStore
 import json
 
+HEALTH_CHECK_MS = 30000  # How often the IMAP session is kept alive and its status refreshed
+
 class FrontPage(ctk.CTk):
     def __init__(self):
         super().__init__()
         self.title("Front Page - Payment Overview")
         self.geometry("1000x700")
 
-        # Scan emails once at startup
-        self.card_data, self.neo_data = main()
+        # Load saved months, then scan only emails newer than what is stored
+        self.store = TransactionStore()
+        self.rescan()
 
         # Track the order of widgets
         self.front_widgets = []
@@ -41,11 +47,9 @@ class FrontPage(ctk.CTk):
         now = datetime.now()
         start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
-        for tx in self.card_data:
+        for tx in self.store.iter_range('card', start_of_month, now):
             try:
-                tx_date = datetime.strptime(tx['date'], '%d-%b-%Y %I:%M %p')
-                if tx_date >= start_of_month and tx_date <= now:
-                    monthly_sum += float(tx['amount'].replace(',', ''))
+                monthly_sum += float(tx['amount'].replace(',', ''))
             except:
                 pass
 
@@ -73,6 +77,7 @@ class FrontPage(ctk.CTk):
             text="Settings",
             command=self.show_settings_popup
         )
+        self.connection_label = ctk.CTkLabel(self, text="", font=ctk.CTkFont(size=14))
 
         # Store each widget with its pack arguments
         self.front_widgets = [
@@ -83,22 +88,70 @@ class FrontPage(ctk.CTk):
             ),
             (chart_placeholder, {"pady": 10}),
             (button, {"pady": 20}),
-            (settings_button, {"pady": 20})
+            (settings_button, {"pady": 20}),
+            (self.connection_label, {"pady": 5})
         ]
 
         # Initial packing
         for widget, pack_args in self.front_widgets:
             widget.pack(**pack_args)
 
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.maintenance = None  # Background thread running IMAPSession.maintain
+        self.check_connection()
+
+    def check_connection(self):
+        # Keep the IMAP session alive between scans and show its health
+        settings = load_settings()
+        delay = HEALTH_CHECK_MS
+        if not has_credentials(settings):
+            self.connection_label.configure(text="IMAP: not configured")
+            self.after(delay, self.check_connection)
+            return
+
+        # NOOPs and reconnects can block for the socket timeout; keep them off the Tk thread
+        session = get_session(settings)
+        if self.maintenance is None or not self.maintenance.is_alive():
+            self.maintenance = threading.Thread(target=session.maintain, daemon=True)
+            self.maintenance.start()
+
+        health = session.health()
+        if health["status"] == "connected":
+            text = "IMAP: connected"
+            if health["reconnects"]:
+                text += f" ({health['reconnects']} reconnects)"
+        elif health["status"] == "backoff":
+            text = f"IMAP: {health['last_error']} - retrying in {health['retry_in']:.0f}s"
+            # Check again as soon as the retry is due
+            delay = min(delay, int(health["retry_in"] * 1000) + 500)
+        else:
+            text = "IMAP: disconnected"
+        self.connection_label.configure(text=text)
+
+        self.after(delay, self.check_connection)
+
+    def on_close(self):
+        close_session()
+        self.destroy()
+
     def show_transaction_viewer(self):
         # Hide all widgets on the front page
         for w, _ in self.front_widgets:
             w.pack_forget()
 
         # Create and pack the TransactionViewer frame passing scanned data
-        self.viewer = TransactionViewer(self, self.card_data, self.neo_data)
+        self.viewer = TransactionViewer(self, self.card_data, self.neo_data, store=self.store)
         self.viewer.pack(fill="both", expand=True)
 
+    def rescan(self):
+        # Scan again over the shared IMAP session and keep what is new
+        card, neo = main(self.store.latest_date())
+        self.store.merge('card', card)
+        self.store.merge('neo', neo)
+        self.card_data = self.store.transactions('card')
+        self.neo_data = self.store.transactions('neo')
+        return self.card_data, self.neo_data
+
     def show_main_page(self):
         self.viewer.destroy()
 
@@ -109,7 +162,7 @@ class FrontPage(ctk.CTk):
     def show_settings_popup(self):
         popup = ctk.CTkToplevel(self)
         popup.title("Settings")
-        popup.geometry("400x300")
+        popup.geometry("400x340")
         self.center_popup(popup)
 
         main_frame = ctk.CTkFrame(popup, corner_radius=10)
@@ -121,7 +174,8 @@ class FrontPage(ctk.CTk):
             "username": tk.StringVar(value=settings.get("username", "")),
             "password": tk.StringVar(value=settings.get("password", "")),
             "imap_server": tk.StringVar(value=settings.get("imap_server", "")),
-            "imap_port": tk.StringVar(value=settings.get("imap_port", ""))
+            "imap_port": tk.StringVar(value=settings.get("imap_port", "")),
+            "imap_security": tk.StringVar(value=settings.get("imap_security", "none"))
         }
 
         for idx, (label, var) in enumerate(fields.items()):
@@ -129,11 +183,17 @@ class FrontPage(ctk.CTk):
             frame.pack(fill='x', pady=5)
             ctk.CTkLabel(frame, text=label.capitalize(), font=ctk.CTkFont(size=17)
             ).pack(side='left', padx=(0, 10))
+            if label == "imap_security":
+                ctk.CTkOptionMenu(frame, variable=var, values=list(SECURITY_MODES), font=ctk.CTkFont(size=17)
+                ).pack(side='left', fill='x', expand=True)
+                continue
             ctk.CTkEntry(frame, textvariable=var, height=30, font=ctk.CTkFont(size=17)
             ).pack(side='left', fill='x', expand=True)
 
         def save_settings():
-            new_settings = {key: var.get() for key, var in fields.items()}
+            # Keep settings that are not editable here, e.g. max_body_bytes
+            new_settings = dict(settings)
+            new_settings.update({key: var.get() for key, var in fields.items()})
             with open(SETTINGS_PATH, 'w') as file:
                 json.dump(new_settings, file, indent=4)
             popup.destroy()
@@ -18,6 +18,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
 import json
+from main import MAX_BODY_BYTES
 
 SETTINGS_PATH = os.path.join(os.path.dirname(__file__), 'settings.json')
 
@@ -26,7 +27,9 @@ def create_default_settings():
         "username": "",
         "password": "",
         "imap_server": "",
-        "imap_port": ""
+        "imap_port": "",
+        "imap_security": "none",
+        "max_body_bytes": MAX_BODY_BYTES
     }
     with open(SETTINGS_PATH, 'w') as file:
         json.dump(default_settings, file, indent=4)
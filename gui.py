@@ -23,9 +23,11 @@ from datetime import datetime, timedelta
 import re
 import json
 import os
+import bisect
 from tkinter import ttk
 from tkcalendar import Calendar
 from functions_gui import ensure_settings_file, load_settings
+from transaction_store import month_number
 
 # Set the theme and color scheme
 ctk.set_appearance_mode("System")  # Modes: "System" (default), "Dark", "Light"
@@ -33,11 +35,195 @@ ctk.set_default_color_theme("blue")  # Themes: "blue" (default), "green", "dark-
 
 SETTINGS_PATH = os.path.join(os.path.dirname(__file__), 'settings.json')
 FONT_SIZE = 17  # Default font size for the application
+DATE_FORMAT = '%d-%b-%Y %I:%M %p'
+EPOCH = datetime(1970, 1, 1)
+SYNC_MOVE_LIMIT = 200  # Above this many moved rows a tree's child list is replaced in one call
+
+def transaction_id(transaction):
+    # Scans attach the Message-ID; fall back to the values for hand-made data
+    return transaction.get('id') or '|'.join(str(v) for v in transaction.values())
+
+def parse_date(transaction):
+    try:
+        return datetime.strptime(transaction.get('date', ''), DATE_FORMAT)
+    except ValueError:
+        return None
+
+def parse_amount(transaction):
+    try:
+        return float(re.sub(r'[^\d\.-]', '', str(transaction.get('amount', ''))))
+    except ValueError:
+        return None
+
+class TransactionRows:
+    """Rows of one Treeview keyed by transaction id, with a sorted index per column.
+
+    Each index is a sorted list of (value, date, iid) keys, so the row order for any
+    column and direction is a plain walk over one list. Small batches are added with
+    bisect; large ones (a first scan, a paged-in month) are appended and sorted once.
+    Dates and amounts are parsed once per row and kept for the filters.
+    """
+
+    BULK = 256  # Batches larger than this re-sort the indexes instead of inserting one by one
+
+    def __init__(self, columns, defaults):
+        self.columns = columns
+        self.defaults = defaults
+        self.transactions = {}
+        self.keys = {}  # iid -> {column: key}
+        self.dates = {}  # iid -> parsed date, None if unparseable
+        self.amounts = {}  # iid -> parsed amount, None if unparseable
+        self.shown = set()  # iids currently attached to the Treeview
+        self.indexes = {col: [] for col in columns}  # Sorted keys; the iid is the last element of each key
+        self.sort_column = 'date'
+        self.descending = True  # Newest first
+
+    def values(self, iid):
+        transaction = self.transactions[iid]
+        return tuple(transaction.get(col, default) for col, default in zip(self.columns, self.defaults))
+
+    def iids(self):
+        index = self.indexes[self.sort_column]
+        return [key[-1] for key in (reversed(index) if self.descending else index)]
+
+    def sort_by(self, column, descending):
+        self.sort_column = column
+        self.descending = descending
+
+    def month(self, iid):
+        date = self.dates.get(iid)
+        return date.strftime('%Y-%m') if date is not None else None
+
+    def display_order(self, iids):
+        return sorted(iids, key=lambda iid: self.keys[iid][self.sort_column], reverse=self.descending)
+
+    def previous_shown(self, iid):
+        """The shown row displayed right before iid, or None if iid would be first."""
+        index = self.indexes[self.sort_column]
+        step = 1 if self.descending else -1
+        pos = bisect.bisect_left(index, self.keys[iid][self.sort_column]) + step
+        while 0 <= pos < len(index):
+            other = index[pos][-1]
+            if other in self.shown:
+                return other
+            pos += step
+        return None
+
+    def update(self, transactions):
+        """Bring the rows in line with a new scan and return (removed, changed, added) iids."""
+        incoming = {transaction_id(tx): tx for tx in transactions}
+        removed = [iid for iid in self.transactions if iid not in incoming]
+        changed = [iid for iid, tx in incoming.items() if iid in self.transactions and self.transactions[iid] != tx]
+        added = [iid for iid in incoming if iid not in self.transactions]
+
+        self._remove(removed + changed)
+        self._add([(iid, incoming[iid]) for iid in added + changed])
+        return removed, changed, added
+
+    def _column_keys(self, iid, transaction):
+        date = self.dates[iid]
+        date = (date - EPOCH).total_seconds() if date is not None else 0.0
+        amount = self.amounts[iid]
+        keys = {}
+        for col in self.columns:
+            if col == 'date':
+                keys[col] = (date, iid)
+            elif col == 'amount':
+                keys[col] = (amount if amount is not None else float('-inf'), date, iid)
+            else:
+                keys[col] = (str(transaction.get(col, '')).lower(), date, iid)
+        return keys
+
+    def _add(self, rows):
+        for iid, transaction in rows:
+            self.transactions[iid] = transaction
+            self.dates[iid] = parse_date(transaction)
+            self.amounts[iid] = parse_amount(transaction)
+            self.keys[iid] = self._column_keys(iid, transaction)
+        for col, index in self.indexes.items():
+            if len(rows) > self.BULK:
+                index.extend(self.keys[iid][col] for iid, _ in rows)
+                index.sort()
+            else:
+                for iid, _ in rows:
+                    bisect.insort(index, self.keys[iid][col])
+
+    def _remove(self, iids):
+        keys = [self.keys.pop(iid) for iid in iids]
+        for iid in iids:
+            del self.transactions[iid]
+            del self.dates[iid]
+            del self.amounts[iid]
+        for col, index in self.indexes.items():
+            if len(iids) > self.BULK:
+                gone = set(iids)
+                index[:] = [key for key in index if key[-1] not in gone]
+            else:
+                for row_keys in keys:
+                    del index[bisect.bisect_left(index, row_keys[col])]
+
+def _stable_rows(iids, position):
+    # Longest subsequence of rows already in the right relative order; those never move
+    tails, tail_ids, parent = [], [], {}
+    for iid in iids:
+        pos = position.get(iid)
+        if pos is None:
+            continue
+        i = bisect.bisect_left(tails, pos)
+        parent[iid] = tail_ids[i - 1] if i else None
+        if i == len(tails):
+            tails.append(pos)
+            tail_ids.append(iid)
+        else:
+            tails[i] = pos
+            tail_ids[i] = iid
+
+    stable = set()
+    iid = tail_ids[-1] if tail_ids else None
+    while iid is not None:
+        stable.add(iid)
+        iid = parent[iid]
+    return stable
+
+def sync_tree(tree, iids, values):
+    """Make the attached rows of tree exactly iids, in order, touching as few rows as possible."""
+    current = tree.get_children()
+    if list(current) == iids:
+        return
+
+    wanted = set(iids)
+    position = {iid: i for i, iid in enumerate(current) if iid in wanted}
+    stable = _stable_rows(iids, position)
+
+    if len(iids) - len(stable) > SYNC_MOVE_LIMIT:
+        # Large changes (e.g. a first scan or a paged-in month): replace the child list in one call
+        for iid in iids:
+            if iid not in position and not tree.exists(iid):
+                tree.insert('', 'end', iid=iid, values=values(iid))
+        tree.set_children('', *iids)  # Also detaches rows left out
+        return
+
+    # Detach the rows that will move too, so sibling indexes below only count placed rows
+    unplaced = [iid for iid in current if iid not in stable]
+    if unplaced:
+        tree.detach(*unplaced)
+    previous = None
+    for iid in iids:
+        if iid not in stable:
+            index = tree.index(previous) + 1 if previous is not None else 0
+            if tree.exists(iid):
+                tree.move(iid, '', index)  # Also reattaches detached rows
+            else:
+                tree.insert('', index, iid=iid, values=values(iid))
+        previous = iid
 
 class TransactionViewer(ctk.CTkFrame):
-    def __init__(self, parent, card_data, neo_data):
+    def __init__(self, parent, card_data, neo_data, store=None):
         super().__init__(parent)
         self.parent = parent
+        self.store = store  # TransactionStore to page older months from, if any
+        self.paging = False
+        self.scroll_positions = {}  # kind -> last (first, last) seen by on_scroll
         self.title_label = ctk.CTkLabel(self, text="Transaction Manager",
                                         font=ctk.CTkFont(size=28, weight="bold"))
         self.title_label.pack(pady=(20, 10))
@@ -60,6 +246,12 @@ class TransactionViewer(ctk.CTkFrame):
         self.card_data = card_data
         self.neo_data = neo_data
 
+        # Row models behind the TreeViews, diffed on every refresh
+        self.card_rows = TransactionRows(('amount', 'vendor', 'card_ending', 'date'),
+                                         ('0.00', 'No vendor', 'Unknown', 'N/A'))
+        self.neo_rows = TransactionRows(('amount', 'account', 'date'),
+                                        ('0.00', 'No account', 'N/A'))
+
         # TreeViews
         self.setup_card_treeview()
         self.setup_neo_treeview()
@@ -69,7 +261,7 @@ class TransactionViewer(ctk.CTkFrame):
         button_frame.pack(pady=10)
 
         self.refresh_btn = ctk.CTkButton(
-            button_frame, text="↻ Refresh", command=self.refresh_data
+            button_frame, text="↻ Refresh", command=self.reload_data
         )
         self.refresh_btn.pack(side='left', padx=5)
 
@@ -89,6 +281,9 @@ class TransactionViewer(ctk.CTkFrame):
             'date_from': tk.StringVar(),
             'date_to': tk.StringVar()
         }
+        self.search_var = tk.StringVar()
+        self.search_term = ''
+        self.card_filter = self.card_filter_bounds()
 
         # Load initial data
         self.refresh_data()
@@ -99,12 +294,14 @@ class TransactionViewer(ctk.CTkFrame):
 
         self.card_tree = ttk.Treeview(self.card_frame, columns=('amount','vendor','card_ending','date'), show='headings')
         for col in ('amount','vendor','card_ending','date'):
-            self.card_tree.heading(col, text=col.title())
+            self.card_tree.heading(col, text=col.title(),
+                                   command=lambda col=col: self.sort_by(self.card_tree, self.card_rows, col))
             self.card_tree.column(col, anchor=tk.CENTER)
+        self.update_headings(self.card_tree, self.card_rows)
         self.card_tree.pack(side='left', expand=True, fill='both')
 
         scrollbar = ttk.Scrollbar(self.card_frame, orient='vertical', command=self.card_tree.yview)
-        self.card_tree.configure(yscrollcommand=scrollbar.set)
+        self.card_tree.configure(yscrollcommand=lambda first, last: self.on_scroll(scrollbar, 'card', first, last))
         scrollbar.pack(side='right', fill='y')
 
     def setup_neo_treeview(self):
@@ -113,38 +310,153 @@ class TransactionViewer(ctk.CTkFrame):
 
         self.neo_tree = ttk.Treeview(self.neo_frame, columns=('amount','account','date'), show='headings')
         for col in ('amount','account','date'):
-            self.neo_tree.heading(col, text=col.title())
+            self.neo_tree.heading(col, text=col.title(),
+                                  command=lambda col=col: self.sort_by(self.neo_tree, self.neo_rows, col))
             self.neo_tree.column(col, anchor=tk.CENTER)
+        self.update_headings(self.neo_tree, self.neo_rows)
         self.neo_tree.pack(side='left', expand=True, fill='both')
 
         scrollbar = ttk.Scrollbar(self.neo_frame, orient='vertical', command=self.neo_tree.yview)
-        self.neo_tree.configure(yscrollcommand=scrollbar.set)
+        self.neo_tree.configure(yscrollcommand=lambda first, last: self.on_scroll(scrollbar, 'neo', first, last))
         scrollbar.pack(side='right', fill='y')
 
+    def sort_by(self, tree, rows, column):
+        # Clicking the current column flips the direction; dates start newest first
+        descending = not rows.descending if column == rows.sort_column else column == 'date'
+        rows.sort_by(column, descending)
+        self.update_headings(tree, rows)
+
+        # Sorting never changes which rows are shown, so reorder the attached ones in one call
+        tree.set_children('', *(iid for iid in rows.iids() if iid in rows.shown))
+        selection = tree.selection()
+        if selection:
+            tree.see(selection[0])
+        else:
+            tree.yview_moveto(0)
+
+    def update_headings(self, tree, rows):
+        for col in rows.columns:
+            arrow = (' ▼' if rows.descending else ' ▲') if col == rows.sort_column else ''
+            tree.heading(col, text=col.title() + arrow)
+
     def refresh_data(self):
-        # Clear both trees
-        self.card_tree.delete(*self.card_tree.get_children())
-        self.neo_tree.delete(*self.neo_tree.get_children())
-
-        # Reverse sort by date
-        for transaction in sorted(self.card_data,
-                                  key=lambda x: datetime.strptime(x.get('date','01-Jan-1970 12:00 AM'), '%d-%b-%Y %I:%M %p'),
-                                  reverse=True):
-            self.card_tree.insert('', 'end', values=(
-                transaction.get('amount', '0.00'),
-                transaction.get('vendor', 'No vendor'),
-                transaction.get('card_ending', 'Unknown'),
-                transaction.get('date', 'N/A')
-            ))
-
-        for transaction in sorted(self.neo_data,
-                                  key=lambda x: datetime.strptime(x.get('date','01-Jan-1970 12:00 AM'), '%d-%b-%Y %I:%M %p'),
-                                  reverse=True):
-            self.neo_tree.insert('', 'end', values=(
-                transaction.get('amount', '0.00'),
-                transaction.get('account', 'No account'),
-                transaction.get('date', 'N/A')
-            ))
+        self.update_tree(self.card_tree, self.card_rows, self.card_data, self.is_card_visible)
+        self.update_tree(self.neo_tree, self.neo_rows, self.neo_data, self.matches_search)
+
+    def on_scroll(self, scrollbar, kind, first, last):
+        scrollbar.set(first, last)
+        first, last = float(first), float(last)
+        if not self.store or self.paging or self.scroll_positions.get(kind) == (first, last):
+            return
+        self.scroll_positions[kind] = (first, last)
+        # A list that fits on screen cannot be scrolled, so it never pages in history
+        if first <= 0 and last >= 1:
+            return
+        self.paging = True
+        self.after_idle(self.page_months, kind)
+
+    def page_months(self, kind):
+        # Load the stored month closest to the screen that is missing from, or right after, the rows on it
+        tree, rows = (self.card_tree, self.card_rows) if kind == 'card' else (self.neo_tree, self.neo_rows)
+        try:
+            if rows.sort_column != 'date':
+                return  # Months only line up with the view when sorted by date
+            top, bottom = self.screen_rows(tree)
+            if top is None:
+                return
+            newer, older = (top, bottom) if rows.descending else (bottom, top)
+            before = tree.prev(newer) if rows.descending else tree.next(newer)
+            after = tree.next(older) if rows.descending else tree.prev(older)
+
+            newest = rows.month(before) if before else None
+            newest = newest or rows.month(newer) or rows.month(older)
+            if newest is None:
+                return
+            # Past the last dated row the view reaches the end of what is loaded
+            oldest = rows.month(after) if after else None
+            missing = self.store.missing_months(kind, newest, oldest)
+            on_screen = {m for m in (rows.month(newer), rows.month(older)) if m}
+            if missing and on_screen:
+                # Fill in from the side touching the screen, so new rows land right next to it
+                month = min(missing, key=lambda m: min(abs(month_number(m) - month_number(s)) for s in on_screen))
+                if self.store.load_month(kind, month, keep=on_screen):
+                    self.sync_store()
+        finally:
+            self.paging = False
+
+    def screen_rows(self, tree):
+        # First and last rows on screen
+        top = next((iid for iid in map(tree.identify_row, range(0, 120, 6)) if iid), None)
+        height = tree.winfo_height()
+        bottom = next((iid for iid in map(tree.identify_row, range(height - 2, 0, -6)) if iid), None)
+        return top, bottom or top
+
+    def sync_store(self):
+        self.card_data = self.store.transactions('card')
+        self.neo_data = self.store.transactions('neo')
+        self.refresh_data()
+
+    def reload_data(self):
+        # Rescan the mailbox and splice any new transactions into the trees
+        self.card_data, self.neo_data = self.parent.rescan()
+        self.refresh_data()
+
+    def update_tree(self, tree, rows, transactions, visible):
+        # Only rows that were added, removed or changed are looked at; the filter has not changed
+        top = self.top_row(tree)
+        removed, changed, added = rows.update(transactions)
+        gone = [iid for iid in removed if tree.exists(iid)]
+        if gone:
+            tree.delete(*gone)
+        rows.shown.difference_update(removed)
+
+        for iid in changed:
+            if tree.exists(iid):
+                tree.item(iid, values=rows.values(iid))
+        # Changed rows may have moved or stopped matching; place them again like new ones
+        moved = [iid for iid in changed if iid in rows.shown]
+        if moved:
+            tree.detach(*moved)
+            rows.shown.difference_update(moved)
+
+        placed = rows.display_order(iid for iid in changed + added if visible(rows, iid))
+        if len(placed) > SYNC_MOVE_LIMIT:
+            rows.shown.update(placed)
+            sync_tree(tree, [iid for iid in rows.iids() if iid in rows.shown], rows.values)
+        else:
+            # Splice each row in after its shown neighbour in the current order
+            for iid in placed:
+                previous = rows.previous_shown(iid)
+                index = tree.index(previous) + 1 if previous is not None else 0
+                if tree.exists(iid):
+                    tree.move(iid, '', index)
+                else:
+                    tree.insert('', index, iid=iid, values=rows.values(iid))
+                rows.shown.add(iid)
+        self.restore_top_row(tree, rows, top)
+
+    def show_rows(self, tree, rows, visible):
+        # The filter or search changed, so every row's visibility is checked again
+        top = self.top_row(tree)
+        iids = [iid for iid in rows.iids() if visible(rows, iid)]
+        sync_tree(tree, iids, rows.values)
+        rows.shown = set(iids)
+        self.restore_top_row(tree, rows, top)
+
+    def top_row(self, tree):
+        # The first row on screen, if the view is scrolled; rows coming and going above it
+        # should not make the view jump. At the very top, new rows simply appear.
+        if tree.yview()[0] <= 0:
+            return None
+        for y in range(0, 120, 6):  # Step past the heading
+            iid = tree.identify_row(y)
+            if iid:
+                return iid
+        return None
+
+    def restore_top_row(self, tree, rows, top):
+        if top is not None and top in rows.shown:
+            tree.yview_moveto(tree.index(top) / len(rows.shown))
 
     def go_back(self):
         self.parent.show_main_page()
@@ -162,19 +474,15 @@ class TransactionViewer(ctk.CTkFrame):
         ctk.CTkButton(main_frame, text="OK", command=popup.destroy, font=ctk.CTkFont(size=FONT_SIZE)).pack(pady=10)
 
     def search_transactions(self):
-        search_term = self.search_var.get().lower()
-        
-        # Show all items if search is empty
-        if not search_term:
-            self.refresh_data()
-            return
-            
-        # Hide items that don't match search
-        for tree in (self.card_tree, self.neo_tree):
-            for item in tree.get_children():
-                values = [str(v).lower() for v in tree.item(item)['values']]
-                if not any(search_term in value for value in values):
-                    tree.detach(item)
+        self.search_term = self.search_var.get().lower()
+        self.card_filter = self.card_filter_bounds()
+        self.show_rows(self.card_tree, self.card_rows, self.is_card_visible)
+        self.show_rows(self.neo_tree, self.neo_rows, self.matches_search)
+
+    def matches_search(self, rows, iid):
+        if not self.search_term:
+            return True
+        return any(self.search_term in str(value).lower() for key, value in rows.transactions[iid].items() if key != 'id')
 
     def show_filter_popup(self):
         popup = ctk.CTkToplevel(self)
@@ -291,64 +599,57 @@ class TransactionViewer(ctk.CTkFrame):
         # Remove grab_set() and wait_window() to prevent closing the filters window
 
     def apply_filters(self):
-        self.refresh_data()  # Reset to full data
-        self.filter_transactions()
-
-    def filter_transactions(self):
+        self.card_filter = self.card_filter_bounds()
+        date_from_val, date_to_val = self.card_filter[2:]
+
+        # Page in the stored months the date range reaches
+        months = self.store.months('card') if self.store else []
+        if months and (date_from_val != datetime.min or date_to_val != datetime.max):
+            # With only "Date To" set the range reaches back to the oldest stored month
+            start = date_from_val if date_from_val != datetime.min else datetime.strptime(months[0], '%Y-%m')
+            end = None if date_to_val == datetime.max else date_to_val
+            if self.store.load_range('card', start, end):
+                self.sync_store()
+        # Rows already on screen have to be checked against the new bounds too
+        self.show_rows(self.card_tree, self.card_rows, self.is_card_visible)
+
+    def card_filter_bounds(self):
         # Get filter values
         amount_from = self.filter_vars['amount_from'].get().strip()
         amount_to = self.filter_vars['amount_to'].get().strip()
         date_from = self.filter_vars['date_from'].get()
         date_to = self.filter_vars['date_to'].get()
-        
-        for item in self.card_tree.get_children():
-            values = self.card_tree.item(item)['values']
-            
-            # Parse transaction amount
-            try:
-                amount_str = re.sub(r'[^\d\.-]', '', values[0])
-                amount = float(amount_str)
-            except ValueError:
-                continue  # Skip items with invalid amount format
-            
-            # Parse filter amounts (only if they're not empty)
-            amount_from_val = float(amount_from) if amount_from else float('-inf')
-            amount_to_val = float(amount_to) if amount_to else float('inf')
-            
-            show_item = True
-            
-            # Inclusive range comparison
-            if not (amount_from_val <= amount <= amount_to_val):
-                show_item = False
-                
-            # Date filtering logic
-            # Parse transaction date
-            try:
-                transaction_date = datetime.strptime(values[3], '%d-%b-%Y %I:%M %p')
-            except ValueError:
-                continue  # Skip items with invalid date format
-            
-            # Parse filter dates (only if they're not empty)
-            date_from_val = datetime.strptime(date_from, '%Y-%m-%d') if date_from else datetime.min
-            if date_to:
-                date_to_val = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(hours=23, minutes=59, seconds=59)
-            else:
-                date_to_val = datetime.max
-            
-            # Inclusive range comparison for dates
-            if not (date_from_val <= transaction_date <= date_to_val):
-                show_item = False
-            
-            # Show or hide the item based on the filters
-            if show_item:
-                self.card_tree.reattach(item, '', 'end')
-            else:
-                self.card_tree.detach(item)
+
+        # Parse filter amounts (only if they're not empty)
+        amount_from_val = float(amount_from) if amount_from else float('-inf')
+        amount_to_val = float(amount_to) if amount_to else float('inf')
+
+        # Parse filter dates (only if they're not empty)
+        date_from_val = datetime.strptime(date_from, '%Y-%m-%d') if date_from else datetime.min
+        if date_to:
+            date_to_val = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(hours=23, minutes=59, seconds=59)
+        else:
+            date_to_val = datetime.max
+
+        return amount_from_val, amount_to_val, date_from_val, date_to_val
+
+    def is_card_visible(self, rows, iid):
+        if not self.matches_search(rows, iid):
+            return False
+
+        amount_from_val, amount_to_val, date_from_val, date_to_val = self.card_filter
+        amount = rows.amounts[iid]
+        transaction_date = rows.dates[iid]
+        if amount is None or transaction_date is None:
+            return True  # Items with invalid amount or date format are never filtered out
+
+        # Inclusive range comparisons
+        return amount_from_val <= amount <= amount_to_val and date_from_val <= transaction_date <= date_to_val
 
     def reset_filters(self):
         # Clear all filter variables
         for var in self.filter_vars.values():
             var.set('')
-        
-        # Refresh data to show all transactions
-        self.refresh_data()
\ No newline at end of file
+
+        # Show all transactions again
+        self.apply_filters()
@@ -0,0 +1,268 @@
+"""
+Email Transaction Scanner - A desktop app for viewing banking transactions from emails
+Copyright (C) 2024 alcybersec
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import imaplib
+import ssl
+import threading
+import time
+
+SECURITY_MODES = ("none", "ssl", "starttls")
+
+KEEPALIVE_INTERVAL = 300  # Seconds between NOOPs on an idle session
+SOCKET_TIMEOUT = 30  # Seconds before a blocking IMAP call is treated as dead
+BACKOFF_BASE = 1  # First reconnect delay in seconds
+BACKOFF_MAX = 300  # Upper bound for the reconnect delay
+
+
+# Open and authenticate a new IMAP connection, raising on failure
+def open_connection(username, password, imap_server, imap_port, security="none"):
+    security = (security or "none").lower()
+    if security not in SECURITY_MODES:
+        raise ValueError(f"Unknown IMAP security mode: {security}")
+
+    port = int(imap_port)
+    if security == "ssl":
+        mail = imaplib.IMAP4_SSL(imap_server, port, ssl_context=ssl.create_default_context(),
+                                 timeout=SOCKET_TIMEOUT)
+    else:
+        # Plaintext, e.g. ProtonMail Bridge on localhost
+        mail = imaplib.IMAP4(imap_server, port, timeout=SOCKET_TIMEOUT)
+        if security == "starttls":
+            mail.starttls(ssl_context=ssl.create_default_context())
+
+    mail.login(username, password)
+    return mail
+
+
+class IMAPSession:
+    """Keeps one authenticated IMAP connection alive and reuses it across scans.
+
+    Calls on the current connection happen under self.lock, which scans hold for
+    their whole duration. maintain() runs on a background thread and opens new
+    connections without the lock, so the GUI thread never waits on a slow login,
+    and close() never waits for a background keepalive.
+    """
+
+    def __init__(self, username, password, imap_server, imap_port, security="none",
+                 keepalive_interval=KEEPALIVE_INTERVAL):
+        self.credentials = (username, password, imap_server, str(imap_port), (security or "none").lower())
+        self.keepalive_interval = keepalive_interval
+
+        self.lock = threading.RLock()
+        self.mail = None
+        self.status = "disconnected"  # "disconnected", "connected" or "backoff"
+        self.last_error = None
+        self.connected_since = None
+        self.last_activity = None
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.reconnects = 0
+        self.connecting = False  # maintain() is logging in without the lock
+        self.closed = False
+
+    def get_connection(self):
+        """Return a live connection, reconnecting if the old one has died.
+
+        Returns None while a reconnect is held back by the backoff delay, so the
+        GUI never blocks on a server that keeps refusing us.
+        """
+        with self.lock:
+            return self._get_connection()
+
+    def _get_connection(self):
+        if self.mail is not None:
+            if self._ping():
+                return self.mail
+            self.invalidate()
+
+        now = time.monotonic()
+        if now < self.next_attempt:
+            return None
+
+        try:
+            mail = open_connection(*self.credentials)
+        except (imaplib.IMAP4.error, OSError, ValueError) as e:
+            self._record_failure(e)
+            return None
+        self._connected(mail)
+        return self.mail
+
+    def keepalive(self):
+        """Send a NOOP if the session has been idle longer than the keepalive interval."""
+        with self.lock:
+            if self.mail is None:
+                return False
+            if time.monotonic() - self.last_activity < self.keepalive_interval:
+                return True
+            if self._ping(force=True):
+                return True
+            self.invalidate()
+            return False
+
+    def maintain(self):
+        """Keep a live session alive, or reconnect once the backoff delay has passed.
+
+        Blocks on the network, so the GUI runs it on a background thread.
+        """
+        # A scan holding the lock is using the connection and needs no keepalive
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self.mail is not None:
+                self.keepalive()
+                if self.closed:
+                    self._logout()  # close() was called during the NOOP
+                return
+            if self.closed or self.connecting or time.monotonic() < self.next_attempt:
+                return
+            self.connecting = True
+        finally:
+            self.lock.release()
+
+        # Log in without the lock; scans and close() carry on meanwhile
+        try:
+            mail = open_connection(*self.credentials)
+        except (imaplib.IMAP4.error, OSError, ValueError) as e:
+            with self.lock:
+                self.connecting = False
+                if not self.closed:
+                    self._record_failure(e)
+            return
+
+        with self.lock:
+            self.connecting = False
+            # A scan may have connected meanwhile, or the session was closed
+            unused = self.closed or self.mail is not None
+            if not unused:
+                self._connected(mail)
+        if unused:
+            try:
+                mail.logout()
+            except (imaplib.IMAP4.error, OSError):
+                pass
+
+    def mark_used(self):
+        self.last_activity = time.monotonic()
+
+    def invalidate(self, error=None):
+        """Drop the current connection without talking to the server again."""
+        with self.lock:
+            if self.mail is not None:
+                try:
+                    self.mail.shutdown()
+                except (imaplib.IMAP4.error, OSError):
+                    pass
+            self.mail = None
+            if error is not None:
+                self._record_failure(error)
+            elif self.status == "connected":
+                self.status = "disconnected"
+
+    def close(self):
+        """Log out cleanly, e.g. when the application exits.
+
+        If maintain() is busy with the connection it logs out once it is done,
+        so the caller never waits on the network.
+        """
+        self.closed = True
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            self._logout()
+        finally:
+            self.lock.release()
+
+    def health(self):
+        """Snapshot of the connection state for display in the GUI."""
+        retry_in = max(0.0, self.next_attempt - time.monotonic()) if self.status == "backoff" else 0.0
+        return {
+            "status": self.status,
+            "last_error": self.last_error,
+            "connected_since": self.connected_since,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "retry_in": retry_in,
+        }
+
+    def _connected(self, mail):
+        if self.connected_since is not None:
+            self.reconnects += 1
+        self.mail = mail
+        self.status = "connected"
+        self.last_error = None
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.connected_since = time.time()
+        self.last_activity = time.monotonic()
+
+    def _logout(self):
+        if self.mail is not None:
+            try:
+                self.mail.logout()
+            except (imaplib.IMAP4.error, OSError):
+                pass
+        self.mail = None
+        self.status = "disconnected"
+
+    def _ping(self, force=False):
+        # Only probe a socket that has been idle for a while; a busy one is known good
+        if not force and time.monotonic() - self.last_activity < self.keepalive_interval:
+            return True
+        try:
+            status, _ = self.mail.noop()
+        except (imaplib.IMAP4.error, OSError):
+            return False
+        if status != 'OK':
+            return False
+        self.mark_used()
+        return True
+
+    def _record_failure(self, error):
+        self.failures += 1
+        delay = min(BACKOFF_BASE * (2 ** (self.failures - 1)), BACKOFF_MAX)
+        self.next_attempt = time.monotonic() + delay
+        self.last_error = str(error)
+        self.status = "backoff"
+        print(f"Error connecting to email server: {error} (retrying in {delay}s)")
+
+
+_session = None
+
+
+# Return the shared session, replacing it if the settings have changed
+def get_session(settings):
+    global _session
+    credentials = (
+        settings.get("username"),
+        settings.get("password"),
+        settings.get("imap_server"),
+        str(settings.get("imap_port")),
+        (settings.get("imap_security") or "none").lower(),
+    )
+    if _session is None or _session.credentials != credentials:
+        if _session is not None:
+            _session.close()
+        _session = IMAPSession(*credentials)
+    return _session
+
+
+def close_session():
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
@@ -18,23 +18,21 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import imaplib
 import email
+import base64
+import quopri
 from email.header import decode_header
-from email.policy import default
+from html.parser import HTMLParser
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 from email.utils import parsedate_to_datetime
 import json
 import os
+import hashlib
+from imap_session import get_session, close_session
 
-# Function to connect to ProtonMail using IMAP (through ProtonMail Bridge)
-def connect_to_email(username, password, imap_server, imap_port):
-    try:
-        mail = imaplib.IMAP4(imap_server, imap_port)  # Non-SSL connection
-        mail.login(username, password)
-        return mail
-    except Exception as e:
-        print(f"Error connecting to email server: {e}")
-        return None
+MAX_BODY_BYTES = 256 * 1024  # Decoded bytes kept per email body; notifications are far smaller
+MESSAGE_BYTES_PER_BODY_BYTE = 4  # Download allowance per body byte, for headers, base64 and alternative parts
+SIZE_BATCH = 500  # Message ids per RFC822.SIZE request
 
 SETTINGS_PATH = os.path.join(os.path.dirname(__file__), 'settings.json')
 
@@ -43,7 +41,9 @@ def create_default_settings():
         "username": "",
         "password": "",
         "imap_server": "",
-        "imap_port": ""
+        "imap_port": "",
+        "imap_security": "none",
+        "max_body_bytes": MAX_BODY_BYTES
     }
     with open(SETTINGS_PATH, 'w') as file:
         json.dump(default_settings, file, indent=4)
@@ -60,26 +60,59 @@ def load_settings():
         with open(SETTINGS_PATH, 'r') as file:
             return json.load(file)
 
+def body_byte_cap(settings):
+    # A missing or malformed max_body_bytes falls back to the default instead of failing the scan
+    try:
+        cap = int(settings.get("max_body_bytes") or MAX_BODY_BYTES)
+    except (TypeError, ValueError):
+        return MAX_BODY_BYTES
+    return cap if cap > 0 else MAX_BODY_BYTES
+
 def has_credentials(settings):
     return all(settings.get(key) for key in ["username", "password", "imap_server", "imap_port"])
 
-# Function to get emails containing card transactions
-def fetch_emails(mail, folder="INBOX"):
+# Look up the size of each message without downloading it
+def fetch_sizes(mail, email_ids):
+    sizes = {}
+    for start in range(0, len(email_ids), SIZE_BATCH):
+        status, data = mail.fetch(b','.join(email_ids[start:start + SIZE_BATCH]), "(RFC822.SIZE)")
+        if status != 'OK':
+            continue
+        for item in data:
+            line = item[0] if isinstance(item, tuple) else item
+            match = re.match(rb'(\d+) \(.*?RFC822\.SIZE (\d+)', line or b'')
+            if match:
+                sizes[match.group(1)] = int(match.group(2))
+    return sizes
+
+# Function to get emails containing card transactions, optionally only those since a date.
+# Messages larger than max_bytes are only downloaded up to max_bytes.
+def fetch_emails(mail, folder="INBOX", since=None, max_bytes=MAX_BODY_BYTES * MESSAGE_BYTES_PER_BODY_BYTE):
     mail.select(folder)
-    status, messages = mail.search(None, 'ALL')
+    if since is not None:
+        status, messages = mail.search(None, 'SINCE', since.strftime('%d-%b-%Y'))
+    else:
+        status, messages = mail.search(None, 'ALL')
     if status == 'OK':
         email_ids = messages[0].split()
         print(f"Found {len(email_ids)} emails")  # Debug print
         email_list = []
+        sizes = fetch_sizes(mail, email_ids)
         for e_id in email_ids:
-            status, msg_data = mail.fetch(e_id, "(RFC822)")
+            if sizes.get(e_id, 0) > max_bytes:
+                # The text part precedes attachments, so the start of the message is enough
+                query = f"(BODY.PEEK[]<0.{max_bytes}>)"
+            else:
+                query = "(RFC822)"
+            status, msg_data = mail.fetch(e_id, query)
             if status == 'OK':
                 for response_part in msg_data:
                     if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1], policy=default)
-                        subject, encoding = decode_header(msg["Subject"])[0]
+                        # compat32 parsing is much cheaper than the EmailMessage policy
+                        msg = email.message_from_bytes(response_part[1])
+                        subject, encoding = decode_header(msg["Subject"] or "")[0]
                         if isinstance(subject, bytes):
-                            subject = subject.decode(encoding if encoding else "utf-8")
+                            subject = subject.decode(encoding if encoding else "utf-8", errors="replace")
                         print(f"Processing email with subject: {subject}")  # Debug print
                         email_list.append(msg)
         return email_list
@@ -146,51 +179,165 @@ def extract_neo_details(body, msg):
         print(f"Error extracting NEO details: {e}")
     return None
 
-def get_email_body(msg):
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            disposition = str(part.get("Content-Disposition"))
-            if content_type == "text/plain" and "attachment" not in disposition:
-                return part.get_payload(decode=True).decode()
-    else:
-        return msg.get_payload(decode=True).decode()
+# Collects visible text from HTML, fed in chunks so large bodies never build a DOM
+class _HTMLTextExtractor(HTMLParser):
+    SKIP_TAGS = {"script", "style", "head", "title"}
+    BLOCK_TAGS = {"br", "p", "div", "tr", "li", "table", "h1", "h2", "h3", "h4", "h5", "h6"}
 
-# Main function
-def main():
-    settings = load_settings()
-    username = settings.get("username")
-    password = settings.get("password")
-    imap_server = settings.get("imap_server")
-    imap_port = settings.get("imap_port")
-    
-    mail = connect_to_email(username, password, imap_server, imap_port)
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.chunks.append(data)
+
+    def text(self):
+        lines = (" ".join(line.split()) for line in "".join(self.chunks).splitlines())
+        return "\n".join(line for line in lines if line)
+
+def html_to_text(html, chunk_size=8192):
+    parser = _HTMLTextExtractor()
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+    parser.close()
+    return parser.text()
+
+# Decode a single non-multipart part, reading at most max_bytes of its content
+def decode_part(part, max_bytes=MAX_BODY_BYTES):
+    # The raw payload as parsed from bytes: non-ASCII bytes are kept as surrogates.
+    # get_payload() would already have decoded those with the charset, which breaks
+    # slicing by bytes and the charset decode below
+    payload = part._payload
+    if not isinstance(payload, str):
+        return None
+
+    encoding = str(part.get("Content-Transfer-Encoding", "")).strip().lower()
+    try:
+        if encoding == "base64":
+            # Every 4 base64 characters carry 3 bytes; the doubled slice leaves room for line breaks
+            chars = (max_bytes // 3 + 1) * 4
+            data = "".join(payload[:chars * 2].split())[:chars]
+            data = base64.b64decode(data[:len(data) // 4 * 4])
+        elif encoding == "quoted-printable":
+            data = quopri.decodestring(payload[:max_bytes * 3].encode("ascii", "surrogateescape"))
+        else:
+            data = payload[:max_bytes].encode("ascii", "surrogateescape")
+    except (ValueError, UnicodeEncodeError):  # binascii.Error is a ValueError
+        # Malformed transfer encoding; better no body than the encoded text
+        return None
+    data = data[:max_bytes]
+
+    charset = part.get_content_charset() or "utf-8"
+    try:
+        return data.decode(charset, errors="replace")
+    except LookupError:
+        # Unknown charset label; fall back rather than lose the email
+        return data.decode("utf-8", errors="replace")
+
+def get_email_body(msg, max_bytes=MAX_BODY_BYTES):
+    html_part = None
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        if "attachment" in str(part.get("Content-Disposition", "")).lower():
+            continue
+        content_type = part.get_content_type()
+        if content_type == "text/plain":
+            return decode_part(part, max_bytes)
+        if content_type == "text/html" and html_part is None:
+            html_part = part
+
+    # HTML-only notification
+    if html_part is not None:
+        html = decode_part(html_part, max_bytes)
+        return html_to_text(html) if html else None
+    return None
+
+# Fetch emails over the session, reconnecting once if the socket dies mid-scan
+def scan_mailbox(session, since=None, max_bytes=MAX_BODY_BYTES * MESSAGE_BYTES_PER_BODY_BYTE):
+    mail = session.get_connection()
     if not mail:
+        return None
+    try:
+        emails = fetch_emails(mail, since=since, max_bytes=max_bytes)
+    except (imaplib.IMAP4.abort, OSError):
+        session.invalidate()
+        mail = session.get_connection()
+        if not mail:
+            return None
+        try:
+            emails = fetch_emails(mail, since=since, max_bytes=max_bytes)
+        except (imaplib.IMAP4.abort, OSError) as e:
+            session.invalidate(e)
+            return None
+    session.mark_used()
+    return emails
+
+# Main function; pass since to only scan emails received from that date on
+def main(since=None):
+    settings = load_settings()
+    if not has_credentials(settings):
+        return [], []
+
+    if since is not None:
+        since -= timedelta(days=1)  # SINCE only compares dates; allow for time zone differences
+
+    max_body_bytes = body_byte_cap(settings)
+
+    # Reuse the authenticated session from the previous scan when possible
+    session = get_session(settings)
+    with session.lock:
+        emails = scan_mailbox(session, since, max_body_bytes * MESSAGE_BYTES_PER_BODY_BYTE)
+    if emails is None:
         return [], []
-    
-    emails = fetch_emails(mail)
     
     card_transactions = []
     neo_transactions = []
 
     for msg in emails:
-        body = get_email_body(msg)
+        try:
+            body = get_email_body(msg, max_body_bytes)
+        except Exception as e:
+            print(f"Error reading email body: {e}")
+            continue
         if not body:
             continue
-            
+
+        # Stable id so the viewer can diff successive scans
+        message_id = (msg.get("Message-ID") or "").strip()
+        if not message_id:
+            message_id = hashlib.sha1(body.encode("utf-8", "replace")).hexdigest()
+
         if "Transaction notification on your Mashreq NEO Account" in body:
             details = extract_neo_details(body, msg)
             if details and any(details.values()):
+                details["id"] = message_id
                 neo_transactions.append(details)
         else:
             details = extract_transaction_details(body)
             if details and any(details.values()):
+                details["id"] = message_id
                 card_transactions.append(details)
 
     return card_transactions, neo_transactions
 
 if __name__ == "__main__":
     card_results, neo_results = main()
+    close_session()
     
     if card_results:
         print("\nCard Transactions:")
@@ -0,0 +1,270 @@
+"""
+Email Transaction Scanner - A desktop app for viewing banking transactions from emails
+Copyright (C) 2024 alcybersec
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import json
+import gzip
+from datetime import datetime
+
+STORE_DIR = os.path.join(os.path.dirname(__file__), 'transactions')
+DATE_FORMAT = '%d-%b-%Y %I:%M %p'
+KINDS = ("card", "neo")
+UNDATED = "undated"  # Partition for transactions whose date could not be parsed
+EAGER_MONTHS = 2  # Current and previous month are always in memory
+MAX_PARTITIONS = 12  # Older partitions kept in memory per kind before the farthest one is dropped
+
+READ_ERRORS = (OSError, EOFError, ValueError)  # Damaged gzip or JSON; JSONDecodeError is a ValueError
+PARTITION_RE = re.compile(r'^(card|neo)-(\d{4}-\d{2}|undated)\.json(\.gz)?$')
+
+
+def month_of(transaction):
+    try:
+        return datetime.strptime(transaction.get('date', ''), DATE_FORMAT).strftime('%Y-%m')
+    except ValueError:
+        return UNDATED
+
+
+def month_number(month):
+    year, mon = map(int, month.split('-'))
+    return year * 12 + mon
+
+
+def previous_month(month):
+    year, mon = map(int, month.split('-'))
+    return f"{year - 1}-12" if mon == 1 else f"{year}-{mon - 1:02d}"
+
+
+class TransactionStore:
+    """Transactions saved in one file per kind and month, loaded into memory lazily.
+
+    Months that have ended are gzip-compressed. The most recent months are loaded
+    up front; older ones are paged in by load_month/load_range. Once more than
+    max_partitions of them are in memory, the months farthest from the ones just
+    requested are dropped again; missing_months finds them when they are needed back.
+    """
+
+    def __init__(self, path=STORE_DIR, eager_months=EAGER_MONTHS, max_partitions=MAX_PARTITIONS):
+        self.path = path
+        self.max_partitions = max_partitions
+        os.makedirs(self.path, exist_ok=True)
+
+        month = datetime.now().strftime('%Y-%m')
+        self.current_month = month
+        self.eager = {UNDATED}
+        for _ in range(eager_months):
+            self.eager.add(month)
+            month = previous_month(month)
+
+        self.available = {kind: set() for kind in KINDS}
+        for name in os.listdir(self.path):
+            match = PARTITION_RE.match(name)
+            if match:
+                self.available[match.group(1)].add(match.group(2))
+
+        self.loaded = {kind: {} for kind in KINDS}
+        self.unreadable = {kind: set() for kind in KINDS}  # Months that failed to load; paging skips them
+        self.compact()
+        for kind in KINDS:
+            for month in self.eager & self.available[kind]:
+                self._load(kind, month)
+
+    def transactions(self, kind):
+        """All transactions currently in memory for kind."""
+        return [tx for partition in self.loaded[kind].values() for tx in partition.values()]
+
+    def months(self, kind):
+        return sorted(m for m in self.available[kind] if m != UNDATED)
+
+    def missing_months(self, kind, newest, oldest=None):
+        """Stored months strictly between oldest and newest that are not in memory, newest first.
+
+        oldest=None means no lower bound, i.e. everything older than newest.
+        """
+        return [m for m in reversed(self.months(kind))
+                if m < newest and (oldest is None or m > oldest)
+                and m not in self.loaded[kind] and m not in self.eager
+                and m not in self.unreadable[kind]]
+
+    def load_month(self, kind, month, keep=()):
+        """Page in one month, dropping the months farthest from it beyond the cap."""
+        self._load(kind, month)
+        self._evict(kind, around=[month], keep=set(keep) | {month})
+        return month in self.loaded[kind]
+
+    def load_range(self, kind, start, end=None):
+        """Page in every month overlapping start..end. Returns True if anything new was loaded."""
+        wanted = self._months_between(kind, start, end)
+        missing = [m for m in wanted if m not in self.loaded[kind] and m not in self.unreadable[kind]]
+        for month in missing:
+            self._load(kind, month)
+        self._evict(kind, around=wanted, keep=set(wanted))
+        return bool(missing)
+
+    def iter_range(self, kind, start, end=None):
+        """Yield transactions dated start..end without keeping unloaded months in memory."""
+        for month in self._months_between(kind, start, end):
+            partition = self.loaded[kind].get(month) or self._read_or_empty(kind, month)
+            for tx in partition.values():
+                try:
+                    date = datetime.strptime(tx.get('date', ''), DATE_FORMAT)
+                except ValueError:
+                    continue
+                if date >= start and (end is None or date <= end):
+                    yield tx
+
+    def latest_date(self):
+        """Date of the newest stored transaction of any kind, or None for an empty store."""
+        latest = None
+        for kind in KINDS:
+            for month in reversed(self.months(kind)):
+                partition = self.loaded[kind].get(month) or self._read_or_empty(kind, month)
+                dates = []
+                for tx in partition.values():
+                    try:
+                        dates.append(datetime.strptime(tx.get('date', ''), DATE_FORMAT))
+                    except ValueError:
+                        pass
+                if dates:
+                    latest = max(dates) if latest is None else max(latest, max(dates))
+                    break
+        return latest
+
+    def merge(self, kind, transactions):
+        """Add scanned transactions, replacing ones with the same id, and save the touched months."""
+        touched = {}
+        for tx in transactions:
+            tx.setdefault('id', '|'.join(str(v) for v in tx.values()))
+            touched.setdefault(month_of(tx), []).append(tx)
+
+        added = 0
+        for month, batch in touched.items():
+            partition = self.loaded[kind].get(month)
+            if partition is None:
+                try:
+                    partition = self._read(kind, month)
+                except READ_ERRORS as e:
+                    print(f"Error reading {kind} transactions for {month}: {e}")
+                    self._set_aside(kind, month)
+                    self.unreadable[kind].discard(month)
+                    partition = {}
+            for tx in batch:
+                if tx['id'] not in partition:
+                    added += 1
+                partition[tx['id']] = tx
+            self._write(kind, month, partition)
+            # Only months already in memory (or always-loaded ones) take the new rows
+            if month in self.loaded[kind] or month in self.eager:
+                self.loaded[kind][month] = partition
+        return added
+
+    def compact(self):
+        """Compress partitions of months that have ended."""
+        for kind in KINDS:
+            for month in list(self.available[kind]):
+                plain = self._file(kind, month, compressed=False)
+                if self._is_closed(month) and os.path.exists(plain):
+                    try:
+                        partition = self._read(kind, month)
+                    except READ_ERRORS as e:
+                        print(f"Error reading {kind} transactions for {month}, not compressing it: {e}")
+                        continue
+                    self._write(kind, month, partition)
+
+    def _months_between(self, kind, start, end):
+        first = start.strftime('%Y-%m')
+        last = end.strftime('%Y-%m') if end is not None else self.current_month
+        return [m for m in self.months(kind) if first <= m <= last]
+
+    def _evict(self, kind, around, keep):
+        # Drop the paged-in months farthest from `around` until the cap is met
+        if not around:
+            return
+        targets = [month_number(m) for m in around]
+        partitions = self.loaded[kind]
+        paged = [m for m in partitions if m not in self.eager]
+        evictable = sorted((m for m in paged if m not in keep),
+                           key=lambda m: min(abs(month_number(m) - t) for t in targets),
+                           reverse=True)
+        for month in evictable[:max(0, len(paged) - self.max_partitions)]:
+            del partitions[month]
+
+    def _is_closed(self, month):
+        return month != UNDATED and month < self.current_month
+
+    def _file(self, kind, month, compressed):
+        return os.path.join(self.path, f"{kind}-{month}.json" + (".gz" if compressed else ""))
+
+    def _load(self, kind, month):
+        # An unreadable month stays out of memory so nothing can write the empty result back,
+        # and is remembered so paging moves on to the months beyond it
+        try:
+            self.loaded[kind][month] = self._read(kind, month)
+        except READ_ERRORS as e:
+            print(f"Error reading {kind} transactions for {month}: {e}")
+            self.unreadable[kind].add(month)
+
+    def _read_or_empty(self, kind, month):
+        try:
+            return self._read(kind, month)
+        except READ_ERRORS as e:
+            print(f"Error reading {kind} transactions for {month}: {e}")
+            return {}
+
+    def _read(self, kind, month):
+        """Read one partition, raising one of READ_ERRORS if the file is damaged."""
+        compressed = self._file(kind, month, compressed=True)
+        plain = self._file(kind, month, compressed=False)
+        if os.path.exists(compressed):
+            with gzip.open(compressed, 'rt', encoding='utf-8') as file:
+                rows = json.load(file)
+        elif os.path.exists(plain):
+            with open(plain, 'r', encoding='utf-8') as file:
+                rows = json.load(file)
+        else:
+            return {}
+        if not isinstance(rows, list):
+            raise ValueError("expected a list of transactions")
+        return {tx['id']: tx for tx in rows if isinstance(tx, dict) and 'id' in tx}
+
+    def _set_aside(self, kind, month):
+        # Keep a damaged partition for manual recovery instead of overwriting it
+        stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        for compressed in (True, False):
+            path = self._file(kind, month, compressed)
+            if os.path.exists(path):
+                os.replace(path, f"{path}.corrupt-{stamp}")
+                print(f"Moved unreadable {os.path.basename(path)} aside to {os.path.basename(path)}.corrupt-{stamp}")
+
+    def _write(self, kind, month, partition):
+        compressed = self._is_closed(month)
+        target = self._file(kind, month, compressed)
+        temp = target + ".tmp"
+        if compressed:
+            with gzip.open(temp, 'wt', encoding='utf-8') as file:
+                json.dump(list(partition.values()), file)
+        else:
+            with open(temp, 'w', encoding='utf-8') as file:
+                json.dump(list(partition.values()), file, indent=4)
+        os.replace(temp, target)
+
+        # A month that just closed leaves its uncompressed file behind
+        stale = self._file(kind, month, not compressed)
+        if os.path.exists(stale):
+            os.remove(stale)
+        self.available[kind].add(month)